@@ -0,0 +1 @@
+from . import aladdinnet, netsyo, xboard
@@ -1,20 +1,49 @@
 import fnmatch
-import traceback
-from typing import Dict, Tuple
+import ipaddress
+import json
+import logging
+import re
+import socket
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+from types import SimpleNamespace
 from urllib.parse import urlparse
 
 import dns.message
 import dns.query
 import dns.rdatatype
-import requests
 import yaml
 from requests.structures import CaseInsensitiveDict
 
-from .base import APIErrorException, APIQueryParams
-from .xboard import XBoard
+from .base import APIErrorException, APIQueryParams, TTLCache, register_board
+from .xboard import XBoard, upstream_call
 
+try:
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
 
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+
+@register_board
 class AladdinNetwork(XBoard):
+    __slots__ = (
+        "dns_cache",
+        "dns_pool",
+        "dns_pool_lock",
+        "dot_ssl_context",
+        "doh_session",
+        "dns_executor",
+    )
     id = "aladdinnet"
     description = "Aladdin Network Clash subscription fetcher with DNS replacement"
     query_params = {
@@ -23,12 +52,179 @@ class AladdinNetwork(XBoard):
         "password": APIQueryParams(required=True),
     }
     ua = "ClashforWindows/0.20.39"
-    dns_cache: dict[tuple[str, str], list[str]] = {}
+    dns_cache_ttl = (60, 3600)  # DNS 缓存有效期上下限（秒）
+    dns_default_ports = {
+        "udp": 53,
+        "tcp": 53,
+        "tls": 853,
+        "https": 443,
+        "quic": 853,
+    }  # 各协议默认端口
+    dns_pool_size = 32  # 每个 DNS 服务器保留的空闲连接上限
+    dns_socket_queries = {
+        "tcp": dns.query.tcp,
+        "tls": dns.query.tcp,  # TLS 已在建立连接时完成握手，传入 sock 后与 TCP 查询一致
+    }  # 可复用连接的协议到 dnspython 查询函数的映射
+    dns_workers = 32  # 并发 DNS 查询线程数
+    policy_table_threshold = 50  # nameserver-policy 条目超过该数量时启用哈希表匹配
+    emit_chunk_size = 64 * 1024  # 输出订阅时每块的大小
+
+    def __init__(self) -> None:
+        super().__init__()
+        # {(dns_server, 域名): [IP]}
+        self.dns_cache = TTLCache(maxsize=1024)
+        # {(proto, host, port): [空闲连接]}
+        self.dns_pool: Dict[Tuple[str, str, int], List[socket.socket]] = {}
+        self.dns_pool_lock = threading.Lock()
+        self.dot_ssl_context = dns.query.make_ssl_context(True, False, ["dot"])
+        self.doh_session = None
+        # 所有请求共用的查询线程池，线程在首次提交时才创建
+        self.dns_executor = ThreadPoolExecutor(
+            max_workers=self.dns_workers,
+            thread_name_prefix="dns"
+        )
+
+    def _open_dns_socket(self, proto: str, host: str, port: int, timeout=3) -> socket.socket:
+        """
+        新建到 DNS 服务器的连接
+
+        :param proto: 协议，tcp / tls
+        :type proto: str
+        :param host: DNS 服务器地址
+        :type host: str
+        :param port: DNS 服务器端口
+        :type port: int
+        :param timeout: 超时
+        :return: 非阻塞套接字
+        :rtype: socket.socket
+        """
+        sock = socket.create_connection((host, port), timeout=timeout)
+        if proto == "tls":
+            try:
+                sock = self.dot_ssl_context.wrap_socket(sock)
+            except Exception:
+                sock.close()
+                raise
+
+        # dnspython 要求传入的连接为非阻塞
+        sock.setblocking(False)
+        return sock
+
+    def _query_pooled(self, proto: str, host: str, port: int, query: dns.message.Message, timeout=3) -> dns.message.Message:
+        """
+        从连接池取出连接发送查询，成功后放回连接池
+        复用的 TCP/TLS 连接可能已被服务器关闭，失败时用新连接重试一次
+
+        :param proto: 协议，tcp / tls
+        :type proto: str
+        :param host: DNS 服务器地址
+        :type host: str
+        :param port: DNS 服务器端口
+        :type port: int
+        :param query: DNS 查询
+        :type query: dns.message.Message
+        :param timeout: 超时
+        :return: DNS 响应
+        :rtype: dns.message.Message
+        """
+        pool_key = (proto, host, port)
+        with self.dns_pool_lock:
+            idle = self.dns_pool.get(pool_key)
+            sock = idle.pop() if idle else None
+
+        reused = sock is not None
+        while True:
+            if sock is None:
+                sock = self._open_dns_socket(proto, host, port, timeout=timeout)
+
+            try:
+                response = self.dns_socket_queries[proto](
+                    query, host, port=port, timeout=timeout, sock=sock)
+            except Exception:
+                sock.close()
+                if reused:
+                    sock, reused = None, False
+                    continue
+                raise
+            break
+
+        with self.dns_pool_lock:
+            idle = self.dns_pool.setdefault(pool_key, [])
+            if len(idle) < self.dns_pool_size:
+                idle.append(sock)
+                sock = None
+        if sock is not None:
+            sock.close()
+
+        return response
+
+    def _query_udp(self, proto: str, host: str, port: int, query: dns.message.Message, timeout=3) -> dns.message.Message:
+        """
+        通过 UDP 查询，每次新建套接字
+        复用的 UDP 套接字可能收到上一次查询迟到或重复的应答，UDP 套接字创建代价很小，不放入连接池
+
+        :param proto: 协议，固定为 udp
+        :type proto: str
+        :param host: DNS 服务器地址
+        :type host: str
+        :param port: DNS 服务器端口
+        :type port: int
+        :param query: DNS 查询
+        :type query: dns.message.Message
+        :param timeout: 超时
+        :return: DNS 响应
+        :rtype: dns.message.Message
+        """
+        # 忽略来源或内容不匹配的数据报，继续等待本次查询的应答
+        return dns.query.udp(
+            query, host, port=port, timeout=timeout,
+            ignore_unexpected=True, ignore_errors=True)
+
+    def _query_quic(self, proto: str, host: str, port: int, query: dns.message.Message, timeout=3) -> dns.message.Message:
+        """
+        通过 QUIC 查询，每次新建连接
+
+        :param proto: 协议，固定为 quic
+        :type proto: str
+        :param host: DNS 服务器地址
+        :type host: str
+        :param port: DNS 服务器端口
+        :type port: int
+        :param query: DNS 查询
+        :type query: dns.message.Message
+        :param timeout: 超时
+        :return: DNS 响应
+        :rtype: dns.message.Message
+        """
+        return dns.query.quic(query, host, port=port, timeout=timeout)
+
+    # 协议到查询方法的映射，https 参数不同，在 resolve_ipv4 中单独处理
+    dns_query_handlers = {
+        "udp": _query_udp,
+        "tcp": _query_pooled,
+        "tls": _query_pooled,
+        "quic": _query_quic,
+    }
+
+    def _get_doh_session(self):
+        """
+        获取复用的 DoH 会话，未安装 httpx 时返回 None 交给 dnspython 处理
+
+        :return: httpx 会话
+        :rtype: httpx.Client | None
+        """
+        if httpx is None:
+            return None
+
+        with self.dns_pool_lock:
+            if self.doh_session is None:
+                self.doh_session = httpx.Client()
+            return self.doh_session
 
     def resolve_ipv4(self, dns_server: str, query_domain: str, timeout=3):
         """
         解析 DNS 服务器字符串并用 dnspython 查询域名的 IPv4 地址
-        支持缓存，如果缓存命中则直接返回
+        支持缓存，如果缓存命中则直接返回，缓存按记录的 TTL 过期
 
         :param dns_server: DNS 服务器
         :type dns_server: str
@@ -40,8 +236,9 @@ class AladdinNetwork(XBoard):
 
         # 使用 tuple 作为缓存 key
         cache_key = (dns_server, query_domain)
-        if cache_key in self.dns_cache:
-            return self.dns_cache[cache_key]
+        cached_ips = self.dns_cache.get(cache_key)
+        if cached_ips is not None:
+            return cached_ips
 
         # rcode 类型，不查询，直接抛异常
         if dns_server.startswith("rcode://"):
@@ -71,7 +268,7 @@ class AladdinNetwork(XBoard):
             parsed = urlparse(dns_server)
             proto = parsed.scheme
             host = parsed.hostname
-            port = parsed.port or 53
+            port = parsed.port or self.dns_default_ports.get(proto, 53)
 
         if not host:
             raise ValueError(f"Invalid DNS server address: {dns_server}")
@@ -80,27 +277,23 @@ class AladdinNetwork(XBoard):
         query = dns.message.make_query(query_domain, dns.rdatatype.A)
 
         try:
-            if proto == "udp":
-                response = dns.query.udp(
-                    query, host, port=port, timeout=timeout)
-            elif proto == "tcp":
-                response = dns.query.tcp(
-                    query, host, port=port, timeout=timeout)
-            elif proto == "tls":
-                response = dns.query.tls(
-                    query, host, port=port or 853, timeout=timeout)
-            elif proto == "https":
-                response = dns.query.https(query, dns_server, timeout=timeout)
-            elif proto == "quic":
-                response = dns.query.quic(
-                    query, host, port=port, timeout=timeout)
+            if proto == "https":
+                # DoH 需要完整的 URL，单独处理
+                response = dns.query.https(
+                    query, dns_server, timeout=timeout, session=self._get_doh_session())
             else:
-                raise ValueError(f"Unknown protocol: {proto}")
+                query_handler = self.dns_query_handlers.get(proto)
+                if query_handler is None:
+                    raise ValueError(f"Unknown protocol: {proto}")
+                response = query_handler(
+                    self, proto, host, port, query, timeout=timeout)
 
             # 提取 A 记录
             ips = []
+            ttls = []
             for answer in response.answer:
                 if answer.rdtype == dns.rdatatype.A:
+                    ttls.append(answer.ttl)
                     for item in answer.items:
                         ips.append(item.address)
 
@@ -109,134 +302,594 @@ class AladdinNetwork(XBoard):
                     f"No A records found for {query_domain} via {dns_server}"
                 )
 
-            # 缓存结果
-            self.dns_cache[cache_key] = ips
+            # 缓存结果，TTL 限制在上下限之间
+            min_ttl, max_ttl = self.dns_cache_ttl
+            self.dns_cache.set(
+                cache_key,
+                ips,
+                ttl=min(max(min(ttls), min_ttl), max_ttl)
+            )
             return ips
 
         except Exception as e:
-            # 统一用 ValueError 抛出
-            traceback.print_exc()
+            # 统一用 ValueError 抛出，错误信息会返回给客户端，这里只在调试时记录堆栈
+            logger.debug(
+                "DNS query failed for %s via %s", query_domain, dns_server, exc_info=True)
             raise ValueError(
                 f"DNS query failed for {query_domain} via {dns_server}: {e}"
             )
 
-    def replace_pxydom_ip(self, yaml_text: str, timeout=3):
+    @staticmethod
+    def _is_ip_address(server_name: str) -> bool:
         """
-        解析 Clash 订阅，按 nameserver-policy 替换 proxies 的 server 为 IP
+        判断 server 是否已经是 IPv4/IPv6 地址
 
-        :param yaml_text: 订阅文本
-        :type yaml_text: str
+        :param server_name: 服务器地址
+        :type server_name: str
+        :return: 是否为 IP 地址
+        :rtype: bool
+        """
+        try:
+            ipaddress.ip_address(server_name.strip("[]"))
+        except ValueError:
+            return False
+        return True
+
+    def _compile_policy(self, ns_policy: Dict[str, str]) -> Callable[[str], str | None] | None:
+        """
+        预编译 nameserver-policy，将所有域名通配符按具体程度排序后合并为一个正则
+        策略条目较多时，精确域名和纯后缀通配符改用哈希表查找，其余的仍交给正则
+
+        :param ns_policy: nameserver-policy
+        :type ns_policy: Dict[str, str]
+        :return: 匹配函数，输入域名返回命中的 DNS 服务器；没有任何策略时为 None
+        :rtype: Callable[[str], str | None] | None
+        """
+        entries = []
+        for pattern, dns_server in ns_policy.items():
+            # 转换 Clash 通配符到 fnmatch 可以匹配的形式
+            # * -> 只能匹配一级域名 -> *.baidu.com -> ?*.baidu.com?
+            # + -> 匹配多级 -> +.baidu.com -> *baidu.com
+            # . -> 匹配多级 -> .baidu.com -> *.baidu.com
+            pattern = pattern.strip().lower()
+            if pattern.startswith("+.") or pattern.startswith("."):
+                # +.baidu.com 或 .baidu.com -> *.baidu.com
+                match_pattern = "*" + pattern[1:]
+            else:
+                match_pattern = pattern
+            match_pattern = sys.intern(match_pattern)
+
+            # 具体程度：去掉通配前缀后的字面长度越长越具体，长度相同时精确域名优先
+            literal = match_pattern.lstrip("*.")
+            is_wildcard = any(char in match_pattern for char in "*?[")
+            entries.append(((-len(literal), is_wildcard), match_pattern, dns_server))
+
+        if not entries:
+            return None
+
+        # 按具体程度排序，list.sort 是稳定排序，相同具体程度保持原策略顺序
+        # 排序后的下标即为优先级，越小越优先
+        entries.sort(key=lambda entry: entry[0])
+
+        exact: Dict[str, int] = {}  # {域名: 优先级}
+        suffixes: Dict[str, int] = {}  # {后缀: 优先级}
+        regex_ranks = []
+        for rank, (_, match_pattern, _) in enumerate(entries):
+            if len(entries) <= self.policy_table_threshold:
+                regex_ranks.append(rank)
+            elif not any(char in match_pattern for char in "*?["):
+                exact.setdefault(match_pattern, rank)
+            elif match_pattern.startswith("*") and not any(char in match_pattern[1:] for char in "*?["):
+                # *.baidu.com 等价于 endswith(".baidu.com")
+                suffixes.setdefault(match_pattern[1:], rank)
+            else:
+                regex_ranks.append(rank)
+
+        policy_regex = None
+        if regex_ranks:
+            # 正则分支从左到右尝试，第一个匹配的即为最具体的策略
+            policy_regex = re.compile("|".join(
+                f"(?P<p{rank}>{fnmatch.translate(entries[rank][1])})"
+                for rank in regex_ranks
+            ))
+        regex_match = policy_regex.match if policy_regex else None
+        exact_get = exact.get
+        suffix_get = suffixes.get
+
+        def match_policy(server_name: str) -> str | None:
+            best = exact_get(server_name) if exact else None
+
+            if suffixes:
+                # 逐个后缀查表，O(len(server_name)) 次哈希查找
+                for start in range(len(server_name) + 1):
+                    rank = suffix_get(server_name[start:])
+                    if rank is not None and (best is None or rank < best):
+                        best = rank
+
+            if regex_match is not None:
+                match = regex_match(server_name)
+                if match:
+                    rank = int(match.lastgroup[1:])
+                    if best is None or rank < best:
+                        best = rank
+
+            return entries[best][2] if best is not None else None
+
+        return match_policy
+
+    @staticmethod
+    def _skip_event_node(events: List[yaml.Event], index: int) -> int:
+        """
+        跳过一个完整的节点（标量、别名或整个映射/序列）
+
+        :param events: YAML 事件列表
+        :type events: List[yaml.Event]
+        :param index: 节点起始事件下标
+        :type index: int
+        :return: 节点之后的事件下标
+        :rtype: int
+        """
+        depth = 0
+        while True:
+            event = events[index]
+            index += 1
+            if isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+                depth += 1
+            elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+                depth -= 1
+            if depth == 0:
+                return index
+
+    def _iter_event_mapping(self, events: List[yaml.Event], index: int) -> Iterator[Tuple[str | None, int]]:
+        """
+        遍历映射节点的键值对
+
+        :param events: YAML 事件列表
+        :type events: List[yaml.Event]
+        :param index: MappingStartEvent 的下标
+        :type index: int
+        :return: (键，值节点下标)，键不是标量时为 None
+        :rtype: Iterator[Tuple[str | None, int]]
+        """
+        index += 1
+        while not isinstance(events[index], yaml.MappingEndEvent):
+            key_event = events[index]
+            value_index = self._skip_event_node(events, index)
+            if isinstance(key_event, yaml.ScalarEvent):
+                yield key_event.value, value_index
+            else:
+                yield None, value_index
+            index = self._skip_event_node(events, value_index)
+
+    @staticmethod
+    def _resolves_to_str(event: yaml.ScalarEvent) -> bool:
+        """
+        按 SafeLoader 的解析规则判断标量加载后是否为字符串
+        带引号等非 plain 样式或 !!str 标签为字符串，plain 标量需不匹配任何隐式解析器（null、布尔、数字等）
+
+        :param event: 标量事件
+        :type event: yaml.ScalarEvent
+        :return: 是否为字符串
+        :rtype: bool
+        """
+        if event.tag not in (None, "!"):
+            return event.tag == "tag:yaml.org,2002:str"
+
+        if not event.implicit[0]:
+            return True
+
+        value = event.value
+        resolvers = SafeLoader.yaml_implicit_resolvers
+        return not any(
+            regexp.match(value)
+            for _, regexp in (*resolvers.get(value[:1], ()), *resolvers.get(None, ()))
+        )
+
+    def _has_alias_or_merge(self, events: List[yaml.Event], index: int) -> bool:
+        """
+        检查节点内是否含有别名或合并键（<<）
+        事件流上无法跟随别名，含有时需完整加载后处理
+
+        :param events: YAML 事件列表
+        :type events: List[yaml.Event]
+        :param index: 节点起始事件下标
+        :type index: int
+        :return: 是否含有别名或合并键
+        :rtype: bool
+        """
+        for event in events[index:self._skip_event_node(events, index)]:
+            if isinstance(event, yaml.AliasEvent):
+                return True
+            # 作为值出现的 plain "<<" 也会命中，此时只是多走一次完整加载
+            if (
+                isinstance(event, yaml.ScalarEvent)
+                and event.value == "<<"
+                and event.tag is None
+                and event.implicit[0]  # plain 样式（libyaml 的 style 为 ""，纯 Python 为 None）
+            ):
+                return True
+        return False
+
+    def _compose_event_node(self, events: List[yaml.Event], index: int) -> Any:
+        """
+        将一个节点的事件还原为 Python 对象，标量一律为字符串，别名为 None
+
+        :param events: YAML 事件列表
+        :type events: List[yaml.Event]
+        :param index: 节点起始事件下标
+        :type index: int
+        :return: Python 对象
+        :rtype: Any
+        """
+        event = events[index]
+        if isinstance(event, yaml.ScalarEvent):
+            return event.value
+
+        if isinstance(event, yaml.MappingStartEvent):
+            return {
+                key: self._compose_event_node(events, value_index)
+                for key, value_index in self._iter_event_mapping(events, index)
+            }
+
+        if isinstance(event, yaml.SequenceStartEvent):
+            items = []
+            index += 1
+            while not isinstance(events[index], yaml.SequenceEndEvent):
+                items.append(self._compose_event_node(events, index))
+                index = self._skip_event_node(events, index)
+            return items
+
+        return None
+
+    def _resolve_servers(self, ns_policy: Dict[str, str], server_names: Iterable[str], timeout=3) -> Dict[str, str]:
+        """
+        按 nameserver-policy 并发解析代理服务器域名
+
+        :param ns_policy: nameserver-policy
+        :type ns_policy: Dict[str, str]
+        :param server_names: 所有代理的 server
+        :type server_names: Iterable[str]
         :param timeout: 超时
+        :return: {server: 替换用的 IP}，不需要替换的 server 不在其中
+        :rtype: Dict[str, str]
         """
+        policy_match = self._compile_policy(ns_policy)
+        if policy_match is None:
+            return {}  # 没有任何策略，无需替换
+
+        # 热循环中使用的属性和方法提前绑定到局部变量
+        is_ip_address = self._is_ip_address
+        intern = sys.intern
+
+        # 第一遍：只匹配 DNS 策略，收集需要解析的 (dns_server, 域名)
+        # 同一个域名在订阅中经常重复出现，匹配结果按域名记录，只匹配一次
+        targets = []
+        add_target = targets.append
+        matched_policy: Dict[str, str | None] = {}
+        for server_name in server_names:
+            if not isinstance(server_name, str) or not server_name or server_name in matched_policy:
+                continue
+
+            # 域名不区分大小写，统一规范化后再匹配和查询，intern 后重复的域名共享同一个字符串
+            domain = intern(server_name.strip().lower())
+            if is_ip_address(domain):
+                # 已经是 IP 地址，无需匹配和查询
+                matched_dns = matched_policy[server_name] = None
+            else:
+                # 匹配域名通配符，取最具体的策略
+                matched_dns = matched_policy[server_name] = policy_match(domain)
+
+            if not matched_dns:
+                continue  # 没有匹配的 DNS 就跳过
+
+            add_target((server_name, (matched_dns, domain)))
+
+        # 并发查询 IP，每个 (dns_server, 域名) 只查询一次
+        futures = {
+            pair: self.dns_executor.submit(
+                self.resolve_ipv4,
+                pair[0],
+                pair[1],
+                timeout=timeout
+            )
+            for pair in dict.fromkeys(pair for _, pair in targets)
+        }
+        results = {}
         try:
-            data = yaml.safe_load(yaml_text)
-        except Exception as e:
-            raise APIErrorException(
-                code=500,
-                details="Failed to parse YAML subscribe content.",
-            ) from e
+            for pair, future in futures.items():
+                try:
+                    results[pair] = future.result()
+                except ValueError as e:
+                    raise APIErrorException(
+                        code=500,
+                        details=f"Failed to replace the domain with an IP address: {str(e)}",
+                    ) from e
+        finally:
+            # 出错时取消还未开始的查询，不再占用共享线程池
+            for future in futures.values():
+                future.cancel()
+
+        # 第二遍：整理查询结果，替换为第一个 IP
+        replaced = {}
+        for server_name, pair in targets:
+            ips = results[pair]
+            if ips:
+                replaced[server_name] = ips[0]
+
+        return replaced
+
+    def _replace_data(self, data: Any, timeout=3) -> None:
+        """
+        在解析后的订阅对象上直接替换 proxies 的 server 为 IP
+
+        :param data: 解析后的订阅
+        :type data: Any
+        :param timeout: 超时
+        """
+        dns_config = data.get("dns") if isinstance(data, dict) else None
+        ns_policy = dns_config.get("nameserver-policy") if isinstance(dns_config, dict) else None
 
-        if "dns" not in data or "nameserver-policy" not in data["dns"]:
+        # dict: {'域名通配符': 'dns_server'}
+        if not isinstance(ns_policy, dict):
             raise APIErrorException(
                 code=500,
                 details="dns.nameserver-policy is missing in YAML configuration.",
             )
 
-        # dict: {'域名通配符': 'dns_server'}
-        ns_policy = data["dns"]["nameserver-policy"]
-
-        if "proxies" not in data or not isinstance(data["proxies"], list):
+        proxies = data.get("proxies")
+        if not isinstance(proxies, list):
             raise APIErrorException(
                 code=500,
                 details="proxies list is missing or invalid in YAML configuration",
             )
 
-        for proxy in data["proxies"]:
+        proxies = [proxy for proxy in proxies if isinstance(proxy, dict)]
+        replaced = self._resolve_servers(
+            ns_policy,
+            (proxy.get("server") for proxy in proxies),
+            timeout=timeout
+        )
+        for proxy in proxies:
             server_name = proxy.get("server")
-            if not server_name:
-                continue
+            if isinstance(server_name, str) and server_name in replaced:
+                proxy["server"] = replaced[server_name]
 
-            # 匹配域名通配符
-            matched_dns = None
-            for pattern, dns_server in ns_policy.items():
-                # 转换 Clash 通配符到 fnmatch 可以匹配的形式
-                # * -> 只能匹配一级域名 -> *.baidu.com -> ?*.baidu.com?
-                # + -> 匹配多级 -> +.baidu.com -> *baidu.com
-                # . -> 匹配多级 -> .baidu.com -> *.baidu.com
-                if pattern.startswith("+.") or pattern.startswith("."):
-                    # +.baidu.com 或 .baidu.com -> *.baidu.com
-                    match_pattern = "*" + pattern[1:]
-                elif pattern.startswith("*"):
-                    match_pattern = pattern
-                else:
-                    match_pattern = pattern
-
-                if fnmatch.fnmatch(server_name, match_pattern):
-                    matched_dns = dns_server
-                    break  # 找到第一个匹配的就用
+    def _replace_json(self, data: Any, timeout=3) -> bytes:
+        """
+        替换 JSON 格式订阅中 proxies 的 server 为 IP
 
-            if not matched_dns:
-                continue  # 没有匹配的 DNS 就跳过
+        :param data: 解析后的 JSON 订阅
+        :type data: Any
+        :param timeout: 超时
+        :return: 替换后的订阅文本
+        :rtype: bytes
+        """
+        self._replace_data(data, timeout=timeout)
 
-            # 查询 IP
-            try:
-                ips = self.resolve_ipv4(
-                    matched_dns,
-                    server_name,
-                    timeout=timeout
-                )
-            except ValueError as e:
-                raise APIErrorException(
-                    code=500,
-                    details=f"Failed to replace the domain with an IP address: {str(e)}",
-                ) from e
+        # Clash 可以直接读取 JSON，保持原格式输出
+        return json.dumps(data, ensure_ascii=False).encode()
 
-            if not ips:
-                continue  # 没有 IP，也跳过
-
-            # 替换为第一个 IP
-            proxy["server"] = ips[0]
-
-        return data
-
-    def construct_subscribe(self, query_params: Dict[str, str]) -> Tuple[str | bytes, CaseInsensitiveDict[str]]:
-        baseurl = query_params["baseurl"].rstrip("/")
-        email = query_params["email"]
-        password = query_params["password"]
-        session = requests.Session()
-        session.headers.update({
-            "User-Agent": self.ua
-        })
-
-        auth_data = self.api_login(
-            session,
-            baseurl,
-            email,
-            password
+    def _replace_loaded_yaml(self, yaml_text: str | bytes, timeout=3) -> Iterator[bytes]:
+        """
+        完整加载 YAML 后替换 proxies 的 server 为 IP
+        用于事件流无法直接改写的订阅（含别名或合并键），由加载器展开后再输出
+
+        :param yaml_text: 订阅文本
+        :type yaml_text: str | bytes
+        :param timeout: 超时
+        :return: 替换后的订阅文本块
+        :rtype: Iterator[bytes]
+        """
+        try:
+            data = yaml.load(yaml_text, Loader=SafeLoader)
+        except Exception as e:
+            raise APIErrorException(
+                code=500,
+                details="Failed to parse YAML subscribe content.",
+            ) from e
+
+        self._replace_data(data, timeout=timeout)
+
+        replaced_content = yaml.dump(
+            data,
+            Dumper=SafeDumper,
+            sort_keys=False,
+            allow_unicode=True
         )
+        # DNS 查询须在返回前完成，错误才能在发送响应前报出，因此不写成生成器
+        return iter((replaced_content.encode(),))
 
-        subscribe_url = self.api_get_subscribe(session, baseurl, auth_data)
+    def _iter_emit(self, events: List[yaml.Event]) -> Iterator[bytes]:
+        """
+        逐个事件输出 YAML，按块产出，不在内存中拼接完整的订阅文本
 
+        :param events: YAML 事件列表
+        :type events: List[yaml.Event]
+        :return: 订阅文本块
+        :rtype: Iterator[bytes]
+        """
+        chunks: List[bytes | str] = []
+        counted = 0  # 已计入 buffered 的块数
+        buffered = 0
+        # 输出流没有 encoding 属性时，libyaml 会写入 bytes
+        dumper = SafeDumper(SimpleNamespace(write=chunks.append), allow_unicode=True)
         try:
-            resp = session.get(subscribe_url, timeout=10)
-            resp.raise_for_status()
-        except requests.exceptions.HTTPError as e:
+            for event in events:
+                dumper.emit(event)
+                if len(chunks) == counted:
+                    continue
+
+                # 纯 Python 的 Emitter 按 token 写入，攒够一块再产出
+                buffered += sum(len(chunk) for chunk in chunks[counted:])
+                counted = len(chunks)
+                if buffered >= self.emit_chunk_size:
+                    yield self._join_chunks(chunks)
+                    chunks.clear()
+                    counted = buffered = 0
+
+            if chunks:
+                yield self._join_chunks(chunks)
+        finally:
+            dumper.dispose()
+
+    @staticmethod
+    def _join_chunks(chunks: List[bytes | str]) -> bytes:
+        """
+        合并输出块，libyaml 按输入类型写入 bytes 或 str，统一为 UTF-8 bytes
+
+        :param chunks: 输出块
+        :type chunks: List[bytes | str]
+        :return: 合并后的块
+        :rtype: bytes
+        """
+        return b"".join(
+            chunk.encode() if isinstance(chunk, str) else chunk
+            for chunk in chunks
+        )
+
+    def _replace_yaml(self, yaml_text: str | bytes, timeout=3) -> Iterator[bytes]:
+        """
+        替换 YAML 格式订阅中 proxies 的 server 为 IP
+        只在 YAML 事件流上改写 server 标量，不构造完整的 Python 对象，其余内容原样保留
+        dns 或 proxies 中含有别名或合并键时，改为完整加载后替换
+
+        :param yaml_text: 订阅文本
+        :type yaml_text: str | bytes
+        :param timeout: 超时
+        :return: 替换后的订阅文本块
+        :rtype: Iterator[bytes]
+        """
+        try:
+            events = list(yaml.parse(yaml_text, Loader=SafeLoader))
+        except Exception as e:
             raise APIErrorException(
                 code=500,
-                details=f"Failed to fetch subscription content, server return status code {e.response.status_code}.",
+                details="Failed to parse YAML subscribe content.",
             ) from e
 
-        except requests.exceptions.RequestException as e:
-            traceback.print_exc()
+        # 重新输出时，libyaml 会给部分不宜用 plain 样式的标量（如 emoji、流式集合中带冒号的值）加上引号
+        # 原事件只允许以 plain 样式隐式解析，加引号后会多输出一个 "!" 标签
+        # 对解析结果为字符串的 plain 标量，允许直接输出为引号字符串
+        for event in events:
+            if (
+                isinstance(event, yaml.ScalarEvent)
+                and event.tag is None
+                and event.implicit == (True, False)
+                and self._resolves_to_str(event)
+            ):
+                event.implicit = (True, True)
+
+        # 第一个文档的根节点：StreamStart, DocumentStart, 根节点
+        ns_policy = None
+        proxies_index = None
+        if len(events) > 2 and isinstance(events[2], yaml.MappingStartEvent):
+            for key, value_index in self._iter_event_mapping(events, 2):
+                # dns/proxies 中的别名和合并键、根节点的合并键都会改变实际内容，改为完整加载
+                if key == "<<" or (
+                    key in ("dns", "proxies")
+                    and self._has_alias_or_merge(events, value_index)
+                ):
+                    return self._replace_loaded_yaml(yaml_text, timeout=timeout)
+
+                if key == "dns" and isinstance(events[value_index], yaml.MappingStartEvent):
+                    for dns_key, dns_value_index in self._iter_event_mapping(events, value_index):
+                        if dns_key == "nameserver-policy":
+                            ns_policy = self._compose_event_node(events, dns_value_index)
+                elif key == "proxies":
+                    proxies_index = value_index
+
+        # dict: {'域名通配符': 'dns_server'}
+        if not isinstance(ns_policy, dict):
             raise APIErrorException(
-                code=502,
-                details="Unable to connect to subscription service",
-            ) from e
+                code=500,
+                details="dns.nameserver-policy is missing in YAML configuration.",
+            )
 
-        replaced_content = yaml.safe_dump(
-            self.replace_pxydom_ip(resp.content.decode()),
-            sort_keys=False,
-            allow_unicode=True
+        if proxies_index is None or not isinstance(events[proxies_index], yaml.SequenceStartEvent):
+            raise APIErrorException(
+                code=500,
+                details="proxies list is missing or invalid in YAML configuration",
+            )
+
+        # 收集每个代理的 server 标量：[(事件下标, server)]
+        server_events = []
+        index = proxies_index + 1
+        while not isinstance(events[index], yaml.SequenceEndEvent):
+            if isinstance(events[index], yaml.MappingStartEvent):
+                for key, value_index in self._iter_event_mapping(events, index):
+                    # 与字典路径一致，只替换加载后为字符串的 server（跳过 ~、null、数字等）
+                    if (
+                        key == "server"
+                        and isinstance(events[value_index], yaml.ScalarEvent)
+                        and self._resolves_to_str(events[value_index])
+                    ):
+                        server_events.append((value_index, events[value_index].value))
+            index = self._skip_event_node(events, index)
+
+        replaced = self._resolve_servers(
+            ns_policy,
+            (server_name for _, server_name in server_events),
+            timeout=timeout
         )
+        for event_index, server_name in server_events:
+            server_ip = replaced.get(server_name)
+            if server_ip is None:
+                continue
+
+            # 保留原标量的锚点、标签和引号风格
+            event = events[event_index]
+            events[event_index] = yaml.ScalarEvent(
+                event.anchor,
+                event.tag,
+                event.implicit,
+                server_ip,
+                style=event.style
+            )
+
+        return self._iter_emit(events)
+
+    def replace_pxydom_ip(self, yaml_text: str | bytes, timeout=3) -> bytes | Iterator[bytes]:
+        """
+        解析 Clash 订阅，按 nameserver-policy 替换 proxies 的 server 为 IP
+        订阅内容是 JSON 时直接用 json 模块处理，否则按 YAML 处理
+        DNS 查询在返回前全部完成，YAML 订阅以文本块迭代器返回，边输出边发送
+
+        :param yaml_text: 订阅文本
+        :type yaml_text: str | bytes
+        :param timeout: 超时
+        :return: 替换后的订阅文本
+        :rtype: bytes | Iterator[bytes]
+        """
+        # JSON 是 YAML 的子集，以 { 开头时先尝试按 JSON 解析，失败再按 YAML 解析
+        if yaml_text.lstrip()[:1] in (b"{", "{"):
+            try:
+                data = json.loads(yaml_text)
+            except ValueError:
+                pass
+            else:
+                return self._replace_json(data, timeout=timeout)
+
+        return self._replace_yaml(yaml_text, timeout=timeout)
+
+    def construct_subscribe(self, query_params: Dict[str, str]) -> Tuple[str | bytes | Iterable[bytes], CaseInsensitiveDict[str]]:
+        resp = self.fetch_subscribe(
+            query_params["baseurl"],
+            query_params["email"],
+            query_params["password"],
+            self.ua
+        )
+
+        # 需要完整解析后替换，直接读取全部内容
+        # 响应以 stream=True 发起，下载中途断开同样按无法连接处理
+        with upstream_call(
+            "Failed to fetch subscription content",
+            "subscription service",
+        ):
+            try:
+                content = resp.content
+            finally:
+                resp.close()
+
+        replaced_content = self.replace_pxydom_ip(content)
 
         return replaced_content, resp.headers
@@ -1,11 +1,14 @@
-import importlib
-import os
+import json
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from dataclasses import asdict as dataclass_to_dict
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import (Any, Dict, FrozenSet, Hashable, Iterable, List, Optional,
+                    Tuple, Type)
 
-from flask import make_response as flask_make_response
+from flask import Response as FlaskResponse
 from flask import request as flask_request
 from requests.structures import CaseInsensitiveDict
 from werkzeug.datastructures.structures import MultiDict
@@ -41,13 +44,30 @@ class APIErrorException(Exception):
     code: int
     details: str
     help_msg: dict
+    help_bytes: Optional[bytes]  # 预先序列化的 help_msg
 
-    def __init__(self, code: int, details: str, help_msg: dict = {}) -> None:
+    def __init__(self, code: int, details: str, help_msg: dict = {}, help_bytes: Optional[bytes] = None) -> None:
         self.code = code
         self.details = details
         self.help_msg = help_msg
+        self.help_bytes = help_bytes
         super().__init__(details)
 
+    @staticmethod
+    def dump_help(help_msg: dict) -> bytes:
+        """
+        序列化帮助信息，键排序和转义方式与 Flask 的 jsonify 一致
+
+        :param help_msg: 帮助信息
+        :type help_msg: dict
+        :return: JSON 文本
+        :rtype: bytes
+        """
+        return json.dumps(help_msg, separators=(",", ":"), sort_keys=True).encode()
+
+    # 错误响应结构固定，只需序列化 details 和 help_msg 后填入模板
+    body_template = b'{"code":%d,"details":%s,"help_msg":%s}'
+
     def to_dict(self) -> dict:
         return {
             "code": self.code,
@@ -55,18 +75,123 @@ class APIErrorException(Exception):
             "help_msg": self.help_msg,
         }
 
+    @property
+    def body_bytes(self) -> bytes:
+        """
+        序列化后的错误响应体
+        传入 help_bytes 时直接填入，不再序列化帮助信息
+
+        :return: JSON 响应体
+        :rtype: bytes
+        """
+        help_bytes = self.help_bytes
+        if help_bytes is None:
+            help_bytes = self.dump_help(self.help_msg)
+
+        return self.body_template % (
+            self.code,
+            json.dumps(self.details).encode(),
+            help_bytes,
+        )
+
+
+class TTLCache:
+    """
+    带过期时间和容量上限的 LRU 缓存（线程安全）
+    """
+    __slots__ = ("maxsize", "_data", "_lock")
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        读取缓存，已过期的条目会被移除
+
+        :param key: 缓存键
+        :type key: Hashable
+        :param default: 未命中时的返回值
+        :type default: Any
+        :return: 缓存值
+        :rtype: Any
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+        """
+        写入缓存，超出容量时淘汰最久未使用的条目
+
+        :param key: 缓存键
+        :type key: Hashable
+        :param value: 缓存值
+        :type value: Any
+        :param ttl: 有效期（秒）
+        :type ttl: float
+        """
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        移除并返回缓存
+
+        :param key: 缓存键
+        :type key: Hashable
+        :param default: 未命中时的返回值
+        :type default: Any
+        :return: 缓存值（不检查是否过期）
+        :rtype: Any
+        """
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[1]
+
 
 class BaseBoard(ABC):
+    __slots__ = ("help_dict", "help_bytes", "param_rules")  # 实例只保存帮助信息和校验规则，其余均为类属性
     id: str = ""  # 名称
     description: str = ""  # 描述
     query_params: Dict[str, APIQueryParams] = {}  # 查询参数
-    allowed_headers = [
-        "content-disposition",
-        "subscription-userinfo",
-        "profile-title",
-        "profile-update-interval",
-        "profile-web-page-url"
-    ]  # 允许传递给响应的头
+    allowed_headers = (
+        "Content-Disposition",
+        "Subscription-Userinfo",
+        "Profile-Title",
+        "Profile-Update-Interval",
+        "Profile-Web-Page-Url"
+    )  # 允许传递给响应的头（Content-Type 单独处理），按规范大小写输出
+
+    def __init__(self) -> None:
+        # 查询参数在类定义时已固定，帮助信息只需生成一次
+        self.help_dict = dataclass_to_dict(self.help_generator())
+        # 校验失败时直接填入错误响应，不必每次序列化
+        self.help_bytes = APIErrorException.dump_help(self.help_dict)
+        # 校验规则同样只需展开一次：(名称, 强制需要, 默认值, 可用值集合, 可用值列表)
+        self.param_rules: Tuple[Tuple[str, bool, Optional[str], Optional[FrozenSet[str]], Optional[List[str]]], ...] = tuple(
+            (
+                key,
+                meta.required,
+                meta.default,
+                None if meta.available is None else frozenset(meta.available),
+                meta.available,
+            )
+            for key, meta in self.query_params.items()
+        )
 
     def _helper_query_params(self) -> Dict[str, APIQueryParams]:
         """
@@ -143,29 +268,31 @@ class BaseBoard(ABC):
         """
         normalized: Dict[str, str] = {}
 
-        for key, meta in self.query_params.items():
+        for key, required, default, available_set, available in self.param_rules:
             value = query_params.get(key)
 
             # 缺失查询参数
             if value is None:
-                if meta.required:
+                if required:
                     raise APIErrorException(
                         400,
                         f"Query parameter {key} is required.",
-                        dataclass_to_dict(self.help_generator())
+                        self.help_dict,
+                        self.help_bytes
                     )
 
                 # 使用默认值
-                if meta.default is not None:
-                    normalized[key] = meta.default
+                if default is not None:
+                    normalized[key] = default
                 continue
 
             # 检查强制需要
-            if meta.available is not None and value not in meta.available:
+            if available_set is not None and value not in available_set:
                 raise APIErrorException(
                     400,
-                    f"The query parameter {key} must be one of {meta.available}.",
-                    dataclass_to_dict(self.help_generator())
+                    f"The query parameter {key} must be one of {available}.",
+                    self.help_dict,
+                    self.help_bytes
                 )
 
             normalized[key] = value
@@ -175,14 +302,14 @@ class BaseBoard(ABC):
         return normalized
 
     @abstractmethod
-    def construct_subscribe(self, query_params: Dict[str, str]) -> Tuple[str | bytes, CaseInsensitiveDict[str]]:
+    def construct_subscribe(self, query_params: Dict[str, str]) -> Tuple[str | bytes | Iterable[bytes], CaseInsensitiveDict[str]]:
         """
         构造订阅文本
 
         :param query_params: 查询参数
         :type query_params: Dict[str, str]
-        :return: 订阅文本，订阅响应头
-        :rtype: Tuple[str | bytes, CaseInsensitiveDict[str]]
+        :return: 订阅文本（或按块产出的迭代器，以流式响应发送），订阅响应头
+        :rtype: Tuple[str | bytes | Iterable[bytes], CaseInsensitiveDict[str]]
         """
         ...
 
@@ -196,43 +323,51 @@ class BaseBoard(ABC):
         # 获取订阅链接和请求头
         sub_content, sub_headers = self.construct_subscribe(query_params)
 
-        # 构建响应请求
-        response = flask_make_response(sub_content, 200)
+        # 只遍历固定的允许列表，sub_headers 不区分大小写，直接查找
+        # 一次性传入构造函数，不逐个修改响应头
+        headers = [
+            (key, sub_headers[key])
+            for key in self.allowed_headers
+            if key in sub_headers
+        ]
+
+        # 构建响应请求，迭代器内容直接交给 WSGI 服务器逐块发送
+        return FlaskResponse(
+            sub_content,
+            200,
+            headers=headers,
+            content_type=sub_headers.get(
+                "Content-Type",
+                "text/plain; charset=utf-8"
+            ),
+            direct_passthrough=True
+        )
 
-        for key, value in sub_headers.items():
-            if key.lower() in self.allowed_headers:
-                response.headers[key] = value
 
-        response.content_type = sub_headers.get(
-            "Content-Type",
-            "text/plain; charset=utf-8"
-        )
+BOARD_REGISTRY: List[Type[BaseBoard]] = []  # 已注册的 Board 类
 
-        return response
+
+def register_board(board_class: Type[BaseBoard]) -> Type[BaseBoard]:
+    """
+    注册 Board 类的装饰器，类定义时即加入 BOARD_REGISTRY
+
+    :param board_class: Board 类
+    :type board_class: Type[BaseBoard]
+    :return: 原 Board 类
+    :rtype: Type[BaseBoard]
+    """
+    BOARD_REGISTRY.append(board_class)
+    return board_class
 
 
-def load_boards(base_dir: str = "board") -> Dict[str, BaseBoard]:
+def load_boards() -> Dict[str, BaseBoard]:
     """
-    遍历 board 目录，动态加载每个 .py 文件中的 Board 类
-    假设每个 board 文件中只有一个 BaseBoard 子类
-    返回 dict[name] = board_class
+    实例化所有已注册的 Board 类
+    Board 模块由 board/__init__.py 导入，导入时通过 register_board 完成注册
+    返回 dict[name] = board_instance
     """
     boards = {}
-    for filename in os.listdir(base_dir):
-        if filename.startswith("_") or not filename.endswith(".py"):
-            continue
-
-        modulename = filename[:-3]  # 去掉 .py
-        module = importlib.import_module(f"{base_dir}.{modulename}")
-
-        # 找 BaseBoard 子类
-        for attr_name in dir(module):
-            attr = getattr(module, attr_name)
-            try:
-                from .base import BaseBoard
-                if issubclass(attr, BaseBoard) and attr is not BaseBoard:
-                    instance = attr()
-                    boards[instance.id] = instance
-            except TypeError:
-                continue  # attr 不是 class
+    for board_class in BOARD_REGISTRY:
+        instance = board_class()
+        boards[instance.id] = instance
     return boards
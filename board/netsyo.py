@@ -1,14 +1,15 @@
-import traceback
-from typing import Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
 
 import requests
-from requests.structures import CaseInsensitiveDict
 
-from board.base import APIErrorException, APIQueryParams
-from board.xboard import XBoard
+from board.base import APIErrorException, APIQueryParams, register_board
+from board.xboard import XBoard, endpoints, load_json, upstream_call
 
 
+@register_board
 class Netsyo(XBoard):
+    __slots__ = ("unlock_executor",)
     id = "netsyo"
     description = "Dynamic subscription fetcher for Netsyo providers"
     query_params = {
@@ -17,8 +18,17 @@ class Netsyo(XBoard):
         "password": APIQueryParams(required=True),
         "ua": APIQueryParams(default="Request User-Agent"),
     }
+    unlock_workers = 16  # 并发解锁订阅限制的线程数
 
-    def api_unlock_subscribe(self, session: requests.Session, baseurl: str, auth_data: str) -> bool:
+    def __init__(self) -> None:
+        super().__init__()
+        # 解锁和获取订阅链接互不依赖，解锁放到线程池中与后者并行
+        self.unlock_executor = ThreadPoolExecutor(
+            max_workers=self.unlock_workers,
+            thread_name_prefix="netsyo-unlock"
+        )
+
+    def api_unlock_subscribe(self, session: requests.Session, baseurl: str, auth_data: str, ua: str) -> bool:
         """
         解锁订阅限制（三分钟）
         
@@ -28,12 +38,17 @@ class Netsyo(XBoard):
         :type baseurl: str
         :param auth_data: 登录令牌
         :type auth_data: str
+        :param ua: User-Agent
+        :type ua: str
         :return: 是否成功
         :rtype: bool
         """
-        url = f"{baseurl}/api/v1/user/bootstrap"
+        url = endpoints(baseurl).bootstrap
 
-        try:
+        with upstream_call(
+            "Failed to unlock subscription restrict",
+            "subscription service",
+        ):
             resp = session.post(
                 url,
                 data={
@@ -41,72 +56,43 @@ class Netsyo(XBoard):
                 },
                 headers={
                     "Authorization": auth_data,
+                    "User-Agent": ua,
                 },
                 timeout=5,
             )
             resp.raise_for_status()
 
-        except requests.exceptions.HTTPError as e:
-            raise APIErrorException(
-                code=500,
-                details=f"Failed to unlock subscription restrict, server return status code {e.response.status_code}.",
-            ) from e
-
-        except requests.exceptions.RequestException as e:
-            traceback.print_exc()
-            raise APIErrorException(
-                code=502,
-                details="Unable to connect to subscription service",
-            ) from e
-
-        try:
-            json_data = resp.json()
-            success = json_data.get("data") == 1
-        except ValueError as e:
-            # 非法 JSON
-            raise APIErrorException(
-                code=502,
-                details="Invalid JSON response from subscription service",
-            ) from e
-
-        return success
+        json_data = load_json(
+            resp,
+            "Invalid JSON response from subscription service",
+        )
 
-    def construct_subscribe(self, query_params: Dict[str, str]) -> Tuple[str | bytes, CaseInsensitiveDict[str]]:
-        baseurl = query_params["baseurl"].rstrip("/")
-        email = query_params["email"]
-        password = query_params["password"]
-        session = requests.Session()
-        session.headers.update({
-            "User-Agent": query_params["ua"]
-        })
+        return json_data.get("data") == 1
 
-        auth_data = self.api_login(
+    def api_authorize(self, session: requests.Session, baseurl: str, email: str, password: str, ua: str) -> Tuple[str, str]:
+        auth_data = self.api_login(session, baseurl, email, password, ua)
+        unlock_future = self.unlock_executor.submit(
+            self.api_unlock_subscribe,
             session,
             baseurl,
-            email,
-            password
+            auth_data,
+            ua
         )
-        if not self.api_unlock_subscribe(session, baseurl, auth_data):
+        subscribe_url = self.api_get_subscribe(session, baseurl, auth_data, ua)
+
+        # 订阅内容须在解锁完成后才能获取
+        if not unlock_future.result():
             raise APIErrorException(
                 code=500,
                 details="Failed to unlock subscription restrict"
             )
-        subscribe_url = self.api_get_subscribe(session, baseurl, auth_data)
 
-        try:
-            resp = session.get(subscribe_url, timeout=10)
-            resp.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            raise APIErrorException(
-                code=500,
-                details=f"Failed to fetch subscription content, server return status code {e.response.status_code}.",
-            ) from e
+        return auth_data, subscribe_url
 
-        except requests.exceptions.RequestException as e:
-            traceback.print_exc()
+    def api_refresh(self, session: requests.Session, baseurl: str, auth_data: str, ua: str) -> None:
+        # 解锁只维持三分钟，使用缓存的订阅链接前仍需重新解锁
+        if not self.api_unlock_subscribe(session, baseurl, auth_data, ua):
             raise APIErrorException(
-                code=502,
-                details="Unable to connect to subscription service",
-            ) from e
-
-        return resp.content, resp.headers
+                code=500,
+                details="Failed to unlock subscription restrict"
+            )
@@ -1,14 +1,131 @@
-import traceback
-from typing import Dict, Tuple
+import hashlib
+import json
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Dict, Iterable, Iterator, Tuple
+from urllib.parse import urlencode
 
 import requests
 from flask import request as flask_request
+from requests.adapters import HTTPAdapter
 from requests.structures import CaseInsensitiveDict
+from urllib3.util import Retry
+from werkzeug.wsgi import ClosingIterator
 
-from .base import APIErrorException, APIQueryParams, BaseBoard
+from .base import (APIErrorException, APIQueryParams, BaseBoard, TTLCache,
+                   register_board)
 
+logger = logging.getLogger(__name__)
 
+# 所有请求共用的会话，复用到上游的 TCP/TLS 连接
+# User-Agent 随每个请求不同，通过请求参数传入，不修改会话的 headers
+# 连接失败和网关类错误（502/503/504）在连接池内短暂退避后重试，不必让客户端重走整条登录流程
+# 重试用尽后仍返回最后的响应，由各 API 的 raise_for_status 按原有方式报错
+RETRY = Retry(
+    total=2,
+    backoff_factor=0.2,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset(["GET", "POST"]),
+    raise_on_status=False,
+    respect_retry_after_header=False,  # 不按上游的 Retry-After 长时间占用工作线程
+)
+ADAPTER = HTTPAdapter(max_retries=RETRY, pool_connections=32, pool_maxsize=64)
+
+SESSION = requests.Session()
+SESSION.mount("https://", ADAPTER)
+SESSION.mount("http://", ADAPTER)
+# 共享会话不保存 Cookie，避免不同用户的请求之间串用
+SESSION.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+
+@dataclass(frozen=True, slots=True)
+class XBoardEndpoints:
+    """
+    XBoard API 地址
+    """
+    login: str  # 登录
+    subscribe: str  # 获取订阅链接
+    bootstrap: str  # 初始化（Netsyo 用于解锁订阅限制）
+
+
+@lru_cache(maxsize=256)
+def endpoints(baseurl: str) -> XBoardEndpoints:
+    """
+    按主机生成并缓存 API 地址，避免每次请求重复拼接
+
+    :param baseurl: 主机
+    :type baseurl: str
+    :return: API 地址
+    :rtype: XBoardEndpoints
+    """
+    base = baseurl.rstrip("/")
+    return XBoardEndpoints(
+        login=f"{base}/api/v1/passport/auth/login",
+        subscribe=f"{base}/api/v1/user/getSubscribe",
+        bootstrap=f"{base}/api/v1/user/bootstrap",
+    )
+
+
+@contextmanager
+def upstream_call(failed: str, service: str) -> Iterator[None]:
+    """
+    将上游请求异常统一转换为 API 错误异常
+    HTTP 状态码错误 -> 500，网络/超时/DNS/连接错误 -> 502
+    连接失败只记录异常类型（异常信息可能包含带令牌的订阅链接），完整堆栈仅在 DEBUG 级别输出
+
+    :param failed: HTTP 状态码错误时的错误信息前缀
+    :type failed: str
+    :param service: 无法连接时的服务名称
+    :type service: str
+    """
+    try:
+        yield
+
+    except requests.exceptions.HTTPError as e:
+        # 流式请求未读取响应体，需手动关闭以归还连接
+        e.response.close()
+        raise APIErrorException(
+            code=500,
+            details=f"{failed}, server return status code {e.response.status_code}.",
+        ) from e
+
+    except requests.exceptions.RequestException as e:
+        logger.warning(
+            "Unable to connect to %s: %s",
+            service,
+            type(e).__name__,
+            exc_info=logger.isEnabledFor(logging.DEBUG)
+        )
+        raise APIErrorException(
+            code=502,
+            details=f"Unable to connect to {service}",
+        ) from e
+
+
+def load_json(resp: requests.Response, details: str) -> Any:
+    """
+    直接从响应的原始字节解析 JSON
+    json.loads 可自行识别 UTF-8/16/32，省去 resp.json() 的编码探测和解码
+
+    :param resp: 上游响应
+    :type resp: requests.Response
+    :param details: 解析失败时的错误信息
+    :type details: str
+    :return: 解析结果
+    :rtype: Any
+    """
+    try:
+        return json.loads(resp.content)
+    except ValueError as e:
+        raise APIErrorException(502, details) from e
+
+
+@register_board
 class XBoard(BaseBoard):
+    __slots__ = ("auth_cache",)
     id = "xboard"
     description = "Dynamic subscription fetcher for XBoard providers"
     query_params = {
@@ -17,12 +134,22 @@ class XBoard(BaseBoard):
         "password": APIQueryParams(required=True),
         "ua": APIQueryParams(default="Request User-Agent"),
     }
+    stream_chunk_size = 64 * 1024  # 转发订阅内容时每块的字节数
+    auth_cache_ttl = 300  # 登录令牌和订阅链接的缓存时间（秒）
+
+    def __init__(self) -> None:
+        super().__init__()
+        # (主机, 邮箱, 密码摘要) -> (登录令牌, 订阅链接)，不保存明文密码
+        self.auth_cache = TTLCache(10000)
 
     def custom_vaildate(self, normalized: Dict[str, str]):
+        # 主机只在校验时规范化一次，后续缓存键和 API 地址直接使用
+        normalized["baseurl"] = normalized["baseurl"].rstrip("/")
         if (normalized.get("ua") == "Request User-Agent"):
-            normalized["ua"] = flask_request.user_agent.string
+            # 直接读取请求头，无需解析 User-Agent
+            normalized["ua"] = flask_request.headers.get("User-Agent", "")
 
-    def api_login(self, session: requests.Session, baseurl: str, email: str, password: str) -> str:
+    def api_login(self, session: requests.Session, baseurl: str, email: str, password: str, ua: str) -> str:
         """
         登录
 
@@ -34,45 +161,37 @@ class XBoard(BaseBoard):
         :type email: str
         :param password: 密码
         :type password: str
+        :param ua: User-Agent
+        :type ua: str
         :return: 登录令牌
         :rtype: str
         """
-        url = f"{baseurl}/api/v1/passport/auth/login"
+        url = endpoints(baseurl).login
 
-        try:
+        with upstream_call(
+            "Authentication request failed",
+            "authentication service",
+        ):
             resp = session.post(
                 url,
-                data={
+                # 表单结构固定，直接编码为请求体，跳过 requests 的表单编码流程
+                data=urlencode({
                     "email": email,
                     "password": password,
+                }).encode("ascii"),
+                headers={
+                    "Content-Type": "application/x-www-form-urlencoded",
+                    "Accept": "application/json",
+                    "User-Agent": ua,
                 },
                 timeout=5,
             )
-
-            # HTTP status check
             resp.raise_for_status()
 
-        except requests.exceptions.HTTPError as e:
-            raise APIErrorException(
-                code=500,
-                details=f"Authentication request failed, server return status code {e.response.status_code}.",
-            ) from e
-
-        except requests.exceptions.RequestException as e:
-            # Network / timeout / DNS / connection error
-            traceback.print_exc()
-            raise APIErrorException(
-                code=502,
-                details="Unable to connect to authentication service",
-            ) from e
-
-        try:
-            data = resp.json().get("data", {})
-        except ValueError as e:
-            raise APIErrorException(
-                502,
-                "Invalid JSON response from authentication service",
-            ) from e
+        data = load_json(
+            resp,
+            "Invalid JSON response from authentication service",
+        ).get("data", {})
 
         auth_data = data.get("auth_data")
 
@@ -84,7 +203,7 @@ class XBoard(BaseBoard):
 
         return auth_data
 
-    def api_get_subscribe(self, session: requests.Session, baseurl: str, auth_data: str) -> str:
+    def api_get_subscribe(self, session: requests.Session, baseurl: str, auth_data: str, ua: str) -> str:
         """
         获取订阅链接
 
@@ -94,43 +213,33 @@ class XBoard(BaseBoard):
         :type baseurl: str
         :param auth_data: 登录令牌
         :type auth_data: str
+        :param ua: User-Agent
+        :type ua: str
         :return: 订阅链接
         :rtype: str
         """
-        url = f"{baseurl}/api/v1/user/getSubscribe"
+        url = endpoints(baseurl).subscribe
 
-        try:
+        with upstream_call(
+            "Failed to fetch subscription information",
+            "subscription service",
+        ):
             resp = session.get(
                 url,
                 headers={
                     "Authorization": auth_data,
+                    "User-Agent": ua,
                 },
                 timeout=5,
             )
             resp.raise_for_status()
 
-        except requests.exceptions.HTTPError as e:
-            raise APIErrorException(
-                code=500,
-                details=f"Failed to fetch subscription information, server return status code {e.response.status_code}.",
-            ) from e
-
-        except requests.exceptions.RequestException as e:
-            traceback.print_exc()
-            raise APIErrorException(
-                code=502,
-                details="Unable to connect to subscription service",
-            ) from e
-
         # ---- business logic ----
 
-        try:
-            data = resp.json().get("data", {})
-        except ValueError as e:
-            raise APIErrorException(
-                502,
-                "Invalid JSON response from subscription service",
-            ) from e
+        data = load_json(
+            resp,
+            "Invalid JSON response from subscription service",
+        ).get("data", {})
 
         subscribe_url = data.get("subscribe_url")
 
@@ -142,38 +251,151 @@ class XBoard(BaseBoard):
 
         return subscribe_url
 
-    def construct_subscribe(self, query_params: Dict[str, str]) -> Tuple[str | bytes, CaseInsensitiveDict[str]]:
-        baseurl = query_params["baseurl"].rstrip("/")
-        email = query_params["email"]
-        password = query_params["password"]
-        session = requests.Session()
-        session.headers.update({
-            "User-Agent": query_params["ua"]
-        })
-
-        auth_data = self.api_login(
-            session,
+    def api_authorize(self, session: requests.Session, baseurl: str, email: str, password: str, ua: str) -> Tuple[str, str]:
+        """
+        登录并获取订阅链接
+
+        :param session: 请求模块的会话
+        :type session: requests.Session
+        :param baseurl: 主机
+        :type baseurl: str
+        :param email: 邮箱
+        :type email: str
+        :param password: 密码
+        :type password: str
+        :param ua: User-Agent
+        :type ua: str
+        :return: 登录令牌，订阅链接
+        :rtype: Tuple[str, str]
+        """
+        auth_data = self.api_login(session, baseurl, email, password, ua)
+        subscribe_url = self.api_get_subscribe(session, baseurl, auth_data, ua)
+        return auth_data, subscribe_url
+
+    def api_refresh(self, session: requests.Session, baseurl: str, auth_data: str, ua: str) -> None:
+        """
+        使用缓存的登录令牌时，在获取订阅内容前调用
+        用于重新执行 api_authorize 中除登录和获取订阅链接以外的步骤
+
+        :param session: 请求模块的会话
+        :type session: requests.Session
+        :param baseurl: 主机
+        :type baseurl: str
+        :param auth_data: 登录令牌
+        :type auth_data: str
+        :param ua: User-Agent
+        :type ua: str
+        """
+        ...
+
+    def api_fetch_subscribe(self, session: requests.Session, subscribe_url: str, ua: str) -> requests.Response:
+        """
+        获取订阅内容
+
+        :param session: 请求模块的会话
+        :type session: requests.Session
+        :param subscribe_url: 订阅链接
+        :type subscribe_url: str
+        :param ua: User-Agent
+        :type ua: str
+        :return: 以 stream=True 发起的订阅响应
+        :rtype: requests.Response
+        """
+        with upstream_call(
+            "Failed to fetch subscription content",
+            "subscription service",
+        ):
+            resp = session.get(
+                subscribe_url,
+                headers={
+                    "User-Agent": ua,
+                },
+                timeout=10,
+                stream=True,
+            )
+            resp.raise_for_status()
+
+        return resp
+
+    @staticmethod
+    def _is_unauthorized(e: APIErrorException) -> bool:
+        """
+        判断错误是否由上游返回 401/403 引起
+
+        :param e: API 错误异常
+        :type e: APIErrorException
+        :return: 是否为鉴权失败
+        :rtype: bool
+        """
+        cause = e.__cause__
+        return (
+            isinstance(cause, requests.exceptions.HTTPError)
+            and cause.response is not None
+            and cause.response.status_code in (401, 403)
+        )
+
+    def fetch_subscribe(self, baseurl: str, email: str, password: str, ua: str) -> requests.Response:
+        """
+        获取订阅内容，优先使用缓存的登录令牌和订阅链接
+        缓存失效（上游返回 401/403）时清除缓存并重新登录一次
+
+        :param baseurl: 主机
+        :type baseurl: str
+        :param email: 邮箱
+        :type email: str
+        :param password: 密码
+        :type password: str
+        :param ua: User-Agent
+        :type ua: str
+        :return: 以 stream=True 发起的订阅响应
+        :rtype: requests.Response
+        """
+        key = (baseurl, email, hashlib.sha256(password.encode()).digest())
+
+        cached = self.auth_cache.get(key)
+        if cached is not None:
+            auth_data, subscribe_url = cached
+            try:
+                self.api_refresh(SESSION, baseurl, auth_data, ua)
+                return self.api_fetch_subscribe(SESSION, subscribe_url, ua)
+            except APIErrorException as e:
+                if not self._is_unauthorized(e):
+                    raise
+                self.auth_cache.pop(key)
+
+        auth_data, subscribe_url = self.api_authorize(
+            SESSION,
             baseurl,
             email,
-            password
+            password,
+            ua
         )
+        self.auth_cache.set(key, (auth_data, subscribe_url), self.auth_cache_ttl)
 
-        subscribe_url = self.api_get_subscribe(session, baseurl, auth_data)
+        return self.api_fetch_subscribe(SESSION, subscribe_url, ua)
 
-        try:
-            resp = session.get(subscribe_url, timeout=10)
-            resp.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            raise APIErrorException(
-                code=500,
-                details=f"Failed to fetch subscription content, server return status code {e.response.status_code}.",
-            ) from e
+    def _iter_content(self, resp: requests.Response) -> Iterable[bytes]:
+        """
+        按块转发订阅内容，不在内存中缓存完整的响应体
+        WSGI 服务器调用 close() 时关闭响应，归还连接池中的连接
+        HEAD 请求不会迭代响应体，只调用 close()，因此不能用生成器的 finally 关闭
 
-        except requests.exceptions.RequestException as e:
-            traceback.print_exc()
-            raise APIErrorException(
-                code=502,
-                details="Unable to connect to subscription service",
-            ) from e
+        :param resp: 以 stream=True 发起的上游响应
+        :type resp: requests.Response
+        :return: 订阅内容块
+        :rtype: Iterable[bytes]
+        """
+        return ClosingIterator(
+            resp.iter_content(chunk_size=self.stream_chunk_size),
+            resp.close
+        )
+
+    def construct_subscribe(self, query_params: Dict[str, str]) -> Tuple[str | bytes | Iterable[bytes], CaseInsensitiveDict[str]]:
+        resp = self.fetch_subscribe(
+            query_params["baseurl"],
+            query_params["email"],
+            query_params["password"],
+            query_params["ua"]
+        )
 
-        return resp.content, resp.headers
+        return self._iter_content(resp), resp.headers
@@ -0,0 +1,22 @@
+import os
+
+# Gunicorn 在工作目录下会自动加载本文件，环境变量可覆盖默认值
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+
+# 上游请求大多在等待网络，使用线程工作模式让单个进程同时处理多个请求
+worker_class = "gthread"
+workers = int(os.environ.get("WORKERS", os.cpu_count() or 1))
+threads = int(os.environ.get("THREADS", 32))
+
+# 订阅下载和 DNS 替换可能较慢，超时需覆盖上游请求的总耗时
+timeout = int(os.environ.get("TIMEOUT", 60))
+keepalive = 30
+
+# 在主进程中导入应用，Board 只加载一次，工作进程通过 fork 共享
+preload_app = True
+
+
+def post_fork(server, worker):
+    # 日志后台线程无法随 fork 继承，在每个工作进程中单独启动
+    from main import setup_logging
+    setup_logging()
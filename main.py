@@ -1,54 +1,92 @@
-import traceback
+import atexit
+import json
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
-from flask import Flask, jsonify, make_response
+from flask import Flask, Response
 
 from board.base import APIErrorException, load_boards
 
 app = Flask(__name__)
 BOARDS = load_boards()
+logger = logging.getLogger(__name__)
 
+# Board 列表在启动后不再变化，根目录和 404 的响应体只需序列化一次
+ROOT_BODY = json.dumps({
+    "code": 200,
+    "boards": list(BOARDS)
+}, separators=(",", ":")).encode()
+NOT_FOUND_BODY = json.dumps({
+    "code": 404,
+    "details": "Not Found",
+    "boards": list(BOARDS)
+}, separators=(",", ":")).encode()
+INTERNAL_ERROR_BODY = json.dumps({
+    "code": 500,
+    "details": "Internal Server Error"
+}, separators=(",", ":")).encode()
 
-@app.get("/", defaults={"path": ""})
-@app.get("/<path:path>")
-def catch_all(path: str):
-    # 根目录
-    if path == "":
-        return jsonify({
-            "code": 200,
-            "boards": list(BOARDS.keys())
-        })
-
-    # 动态 board 路由
-    elif path.startswith("board/"):
-        name = path.split("/")[1]
-        board = BOARDS.get(name)
-        if board is None:
-            return jsonify({
-                "code": 404,
-                "details": "Not Found",
-                "boards": list(BOARDS.keys())
-            }), 404
-
-        # 调用 board.handle()
-        try:
-            return board.handle()
-        except APIErrorException as e:
-            return jsonify(e.to_dict()), e.code
-        except Exception as e:
-            traceback.print_exc()
-            return jsonify({
-                "code": 500,
-                "details": "Internal Server Error",
-            }), 500
-
-    # 404
-    else:
-        return jsonify({
-            "code": 404,
-            "details": "Not Found",
-            "boards": list(BOARDS.keys())
-        }), 404
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    同进程的日志队列处理器
+    不在调用线程中格式化消息和堆栈，全部留给后台线程
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging() -> None:
+    """
+    配置根日志：请求线程只把记录放入队列，由后台线程格式化并输出
+    日志级别由环境变量 LOG_LEVEL 控制，默认 INFO
+    线程不会随 fork 复制，Gunicorn 需在每个工作进程中调用（见 gunicorn.conf.py）
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(
+        "[%(asctime)s] [%(process)d] [%(levelname)s] %(name)s: %(message)s"
+    ))
+    listener = QueueListener(log_queue, handler)
+
+    root = logging.getLogger()
+    root.handlers[:] = [DeferredQueueHandler(log_queue)]
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+
+    listener.start()
+    atexit.register(listener.stop)
+
+
+@app.get("/")
+def index():
+    return Response(ROOT_BODY, mimetype="application/json")
+
+
+@app.get("/board/<string:name>")
+def board_route(name: str):
+    board = BOARDS.get(name)
+    if board is None:
+        return Response(NOT_FOUND_BODY, 404, mimetype="application/json")
+
+    # 调用 board.handle()
+    try:
+        return board.handle()
+    except APIErrorException as e:
+        return Response(e.body_bytes, e.code, mimetype="application/json")
+    except Exception:
+        logger.exception("Unhandled error in board %s", name)
+        return Response(INTERNAL_ERROR_BODY, 500, mimetype="application/json")
+
+
+@app.errorhandler(404)
+def not_found(e):
+    return Response(NOT_FOUND_BODY, 404, mimetype="application/json")
 
 
 if __name__ == "__main__":
-    app.run(port=8000, debug=True)
+    setup_logging()
+    # 调试模式通过 FLASK_DEBUG=1 开启，默认关闭
+    app.run(port=8000)